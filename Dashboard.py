@@ -1,17 +1,29 @@
+import calendar
+import hashlib
+import io
+
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+
+# Optional Rust-based Excel reader (pandas >= 2.2); fall back to pandas' default
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
 
 # ---------------------------------------------------------
 # 1. LOAD DATA (Excel)
 # ---------------------------------------------------------
-@st.cache_data
-def load_data(file):
-    if file is None:
+@st.cache_data(show_spinner=False)
+def load_data(file_bytes, name):
+    # Cache key is the raw upload bytes + file name, so reruns with the
+    # same upload skip re-parsing the workbook.
+    if not file_bytes:
         return None
 
     # Read first sheet; auto-detect header row
-    xls = pd.ExcelFile(file)
+    xls = pd.ExcelFile(io.BytesIO(file_bytes), engine=EXCEL_ENGINE)
     sheet = xls.sheet_names[0]
 
     preview = pd.read_excel(xls, sheet_name=sheet, header=None, nrows=20)
@@ -53,19 +65,35 @@ def load_data(file):
     if rename:
         df = df.rename(columns=rename)
 
-    # Derive Month / Year Month from Date if needed
+    # Parse dates once here; derive Month / Year Month from Date if needed
     if "Date" in df.columns:
-        dt = pd.to_datetime(df["Date"], errors="coerce")
+        df["Date"] = pd.to_datetime(df["Date"], errors="coerce")
         if "Month" not in df.columns:
-            df["Month"] = dt.dt.strftime("%b")
+            # Month number -> abbreviation lookup; avoids per-row strftime
+            df["Month"] = df["Date"].dt.month.map(dict(enumerate(calendar.month_abbr)))
         if "Year Month" not in df.columns:
-            df["Year Month"] = dt.dt.to_period("M").astype(str)
+            df["Year Month"] = df["Date"].dt.to_period("M").dt.to_timestamp()
+    if "Year Month" in df.columns:
+        df["Year Month"] = pd.to_datetime(df["Year Month"], errors="coerce")
+
+    # Low-cardinality labels repeat on every row; categorical codes cut memory
+    # and make the groupbys / filters below operate on integer codes.
+    category_cols = [
+        "In-Field Activity: Owner Name", "Division", "Territory Code", "Month",
+        "Speciality", "P1", "P2", "P3", "P4",
+    ]
+    for c in category_cols:
+        if c in df.columns:
+            # Stringify first: Excel often mixes numbers and text in a label column
+            # (e.g. 101 and "T1"), which Arrow cannot serialise as one categorical.
+            df[c] = df[c].map(str, na_action="ignore").astype("category")
 
     return df
 
 # ---------------------------------------------------------
 # 2. PRODUCT LIST (P1–P4)
 # ---------------------------------------------------------
+@st.cache_data(show_spinner=False)
 def get_all_products(df):
     product_cols = [c for c in ["P1", "P2", "P3", "P4"] if c in df.columns]
     if not product_cols:
@@ -86,6 +114,62 @@ def filter_by_product(df, product):
     mask = df[product_cols].astype(str).eq(str(product)).any(axis=1)
     return df[mask]
 
+# ---------------------------------------------------------
+# 4. SIDEBAR OPTIONS (cached – full-frame scans)
+# ---------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def get_filter_options(df):
+    def options(col):
+        values = df.get(col, pd.Series(dtype=str)).dropna().astype(str).unique().tolist()
+        return ["All"] + sorted(values)
+
+    return {
+        "Month": options("Month"),
+        "Employee": options("In-Field Activity: Owner Name"),
+        "Division": options("Division"),
+        "Territory": options("Territory Code"),
+        "Product": ["All"] + get_all_products(df),
+    }
+
+# ---------------------------------------------------------
+# 5. SHARED COUNTS (one melt / groupby reused by KPIs + charts)
+# ---------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def _precompute_counts(df):
+    counts = {"product": None, "speciality_product": None, "employee": None}
+
+    product_cols = [c for c in ["P1", "P2", "P3", "P4"] if c in df.columns]
+    if product_cols:
+        id_vars = ["Speciality"] if "Speciality" in df.columns else []
+        melted = (
+            df[id_vars + product_cols]
+            .melt(id_vars=id_vars or None, value_name="Product")
+            .dropna(subset=["Product"])
+        )
+        counts["product"] = melted.groupby("Product", observed=True).size()
+        if id_vars:
+            counts["speciality_product"] = melted.groupby(["Speciality", "Product"], observed=True).size()
+
+    if "In-Field Activity: Owner Name" in df.columns:
+        counts["employee"] = df.groupby("In-Field Activity: Owner Name", observed=True).size()
+
+    return counts
+
+# ---------------------------------------------------------
+# 6. KEY METRICS
+# ---------------------------------------------------------
+@st.cache_data(show_spinner=False)
+def get_key_metrics(df, product_counts):
+    clm_calls = 0
+    if "Call with CLM" in df.columns:
+        clm_calls = int((df["Call with CLM"].astype(str).str.upper() == "YES").sum())
+    return {
+        "total_calls": len(df),
+        "unique_customers": df.get("Customer ID", pd.Series(dtype=object)).nunique(),
+        "unique_products": 0 if product_counts is None else product_counts.index.astype(str).nunique(),
+        "clm_calls": clm_calls,
+    }
+
 # ---------------------------------------------------------
 # STREAMLIT UI SETUP
 # ---------------------------------------------------------
@@ -99,7 +183,14 @@ if not uploaded:
     st.info("Please upload an Excel file (.xlsx or .xls).")
     st.stop()
 
-df = load_data(uploaded)
+# Keep the parsed frame in session state so reruns reuse the live object
+# instead of paying st.cache_data's copy-on-read for the whole frame.
+file_bytes = uploaded.getvalue()
+file_key = hashlib.md5(file_bytes).hexdigest()
+if st.session_state.get("df_key") != file_key:
+    st.session_state["df"] = load_data(file_bytes, uploaded.name)
+    st.session_state["df_key"] = file_key
+df = st.session_state["df"]
 if df is None or df.empty:
     st.error("Could not read data from the uploaded Excel file.")
     st.stop()
@@ -111,25 +202,20 @@ st.success("Data Loaded Successfully!")
 # ---------------------------------------------------------
 st.sidebar.header("FILTERS")
 
-months = ["All"] + sorted(df.get("Month", pd.Series(dtype=str)).dropna().astype(str).unique().tolist())
-selected_month = st.sidebar.selectbox("Month", months)
-
-employees = ["All"] + sorted(df.get("In-Field Activity: Owner Name", pd.Series(dtype=str)).dropna().astype(str).unique().tolist())
-selected_emp = st.sidebar.selectbox("Employee / Owner", employees)
+options = get_filter_options(df)
 
-divisions = ["All"] + sorted(df.get("Division", pd.Series(dtype=str)).dropna().astype(str).unique().tolist())
-selected_div = st.sidebar.selectbox("Division", divisions)
-
-territories = ["All"] + sorted(df.get("Territory Code", pd.Series(dtype=str)).dropna().astype(str).unique().tolist())
-selected_terr = st.sidebar.selectbox("Territory", territories)
-
-product_list = ["All"] + get_all_products(df)
-selected_product = st.sidebar.selectbox("Product", product_list)
+selected_month = st.sidebar.selectbox("Month", options["Month"])
+selected_emp = st.sidebar.selectbox("Employee / Owner", options["Employee"])
+selected_div = st.sidebar.selectbox("Division", options["Division"])
+selected_terr = st.sidebar.selectbox("Territory", options["Territory"])
+selected_product = st.sidebar.selectbox("Product", options["Product"])
 
 # ---------------------------------------------------------
 # APPLY FILTERS (Order matters)
 # ---------------------------------------------------------
-filtered = df.copy()
+# Each filter step returns a new frame and nothing below mutates it, so the
+# shared session-state frame needs no defensive copy.
+filtered = df
 
 if selected_month != "All" and "Month" in filtered.columns:
     filtered = filtered[filtered["Month"].astype(str) == str(selected_month)]
@@ -152,31 +238,25 @@ st.subheader("📊 Key Metrics")
 
 c1, c2, c3, c4 = st.columns(4)
 
-total_calls = len(filtered)
-unique_customers = filtered.get("Customer ID", pd.Series(dtype=object)).nunique()
-unique_products = len(get_all_products(filtered))
-clm_calls = 0
-if "Call with CLM" in filtered.columns:
-    clm_calls = filtered[filtered["Call with CLM"].astype(str).str.upper() == "YES"].shape[0]
+counts = _precompute_counts(filtered)
+metrics = get_key_metrics(filtered, counts["product"])
 
-c1.metric("Total Calls", f"{total_calls:,}")
-c2.metric("Unique Customers Covered", f"{unique_customers:,}")
-c3.metric("Products Discussed", f"{unique_products}")
-c4.metric("CLM Calls", f"{clm_calls:,}")
+c1.metric("Total Calls", f"{metrics['total_calls']:,}")
+c2.metric("Unique Customers Covered", f"{metrics['unique_customers']:,}")
+c3.metric("Products Discussed", f"{metrics['unique_products']}")
+c4.metric("CLM Calls", f"{metrics['clm_calls']:,}")
+
+# Plotly is only needed once there is data to chart; importing it here keeps
+# the pre-upload page from loading its dependency tree.
+import plotly.express as px
 
 # ---------------------------------------------------------
 # CHART 1 – Calls Over Months
 # ---------------------------------------------------------
 if "Year Month" in filtered.columns:
-    tmp = (
-        filtered.assign(_ym=pd.to_datetime(filtered["Year Month"], errors="coerce"))
-        .dropna(subset=["_ym"])
-        .groupby("_ym")
-        .size()
-        .reset_index(name="Calls")
-        .sort_values("_ym")
-    )
-    fig1 = px.line(tmp, x="_ym", y="Calls", markers=True, title="Calls Over Time")
+    # "Year Month" is already datetime64 from load_data; groupby drops NaT and sorts
+    tmp = filtered.groupby("Year Month").size().reset_index(name="Calls")
+    fig1 = px.line(tmp, x="Year Month", y="Calls", markers=True, title="Calls Over Time")
     fig1.update_layout(xaxis_title="Year-Month", yaxis_title="Calls")
     st.plotly_chart(fig1, use_container_width=True)
 
@@ -184,18 +264,9 @@ if "Year Month" in filtered.columns:
 # CHART 2 – Top Products
 # ---------------------------------------------------------
 st.subheader("💊 Top Products Discussed")
-product_cols = [c for c in ["P1", "P2", "P3", "P4"] if c in filtered.columns]
-if product_cols:
-    product_count = (
-        filtered[product_cols]
-        .melt(value_name="Product")
-        .dropna(subset=["Product"])
-        .groupby("Product")
-        .size()
-        .reset_index(name="Count")
-        .sort_values("Count", ascending=False)
-    )
-    fig2 = px.bar(product_count.head(10), x="Product", y="Count", title="Top 10 Discussed Products")
+if counts["product"] is not None:
+    top_products = counts["product"].nlargest(10).reset_index(name="Count")
+    fig2 = px.bar(top_products, x="Product", y="Count", title="Top 10 Discussed Products")
     st.plotly_chart(fig2, use_container_width=True)
 else:
     st.info("No product columns (P1–P4) found.")
@@ -204,15 +275,10 @@ else:
 # CHART 3 – Employee Productivity
 # ---------------------------------------------------------
 st.subheader("👤 Employee Productivity (Calls Made)")
-if "In-Field Activity: Owner Name" in filtered.columns:
-    emp_calls = (
-        filtered.groupby("In-Field Activity: Owner Name")
-        .size()
-        .reset_index(name="Total Calls")
-        .sort_values("Total Calls", ascending=False)
-    )
+if counts["employee"] is not None:
+    top_emps = counts["employee"].nlargest(15).reset_index(name="Total Calls")
     fig3 = px.bar(
-        emp_calls.head(15),
+        top_emps,
         x="In-Field Activity: Owner Name",
         y="Total Calls",
         title="Top Performing Employees",
@@ -224,20 +290,29 @@ if "In-Field Activity: Owner Name" in filtered.columns:
 # CHART 4 – Product vs Speciality Matrix
 # ---------------------------------------------------------
 st.subheader("🧪 Product × Speciality Analysis")
-if "Speciality" in filtered.columns and product_cols:
-    heat_df = (
-        filtered[["Speciality"] + product_cols]
-        .melt(id_vars="Speciality", value_name="Product")
-        .dropna(subset=["Product"])
-        .groupby(["Speciality", "Product"])
-        .size()
-        .reset_index(name="Count")
-    )
-    fig4 = px.density_heatmap(
-        heat_df, x="Product", y="Speciality", z="Count",
-        color_continuous_scale="Blues", title="Product Discussion by Speciality"
+if counts["speciality_product"] is not None:
+    top_n = st.slider("Top specialities / products shown", min_value=5, max_value=50, value=30, step=5)
+
+    # Trim to the busiest specialities and products so the grid stays small
+    sp_counts = counts["speciality_product"]
+    top_specs = sp_counts.groupby(level="Speciality", observed=True).sum().nlargest(top_n).index
+    top_prods = sp_counts.groupby(level="Product", observed=True).sum().nlargest(top_n).index
+    keep = (
+        sp_counts.index.get_level_values("Speciality").isin(top_specs)
+        & sp_counts.index.get_level_values("Product").isin(top_prods)
     )
-    st.plotly_chart(fig4, use_container_width=True)
+    # Pivot to a Speciality × Product matrix server-side instead of letting
+    # density_heatmap re-bin the long-form rows in the browser
+    heat = sp_counts[keep].unstack(fill_value=0)
+    if heat.empty:
+        st.info("No product discussions for the selected specialities.")
+    else:
+        fig4 = px.imshow(
+            heat, aspect="auto", color_continuous_scale="Blues",
+            labels={"x": "Product", "y": "Speciality", "color": "Count"},
+            title="Product Discussion by Speciality",
+        )
+        st.plotly_chart(fig4, use_container_width=True)
 
 # ---------------------------------------------------------
 # RAW DATA PREVIEW